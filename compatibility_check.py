@@ -15,9 +15,11 @@ Use at your own risk - hardware compatibility is not guaranteed.
 
 import os
 import sys
+import atexit
 import subprocess
 import glob
-from time import sleep
+import functools
+from time import sleep, monotonic
 
 # EC Memory offsets from the main omen-fan.py script
 FAN1_OFFSET = 52      # 0x34 - Fan 1 speed control
@@ -28,9 +30,52 @@ CPU_TEMP_OFFSET = 87  # 0x57 - CPU temperature
 GPU_TEMP_OFFSET = 183 # 0xB7 - GPU temperature  
 BOOST_OFFSET = 236    # 0xEC - Boost control
 
+EC_SIZE = 256         # Size of the EC register space
+EC_READY_TIMEOUT = 1.0  # Seconds to wait for the EC interface after modprobe
+
+# Critical offsets checked by test_ec_read_capabilities, with the report
+# prefix for each rendered once at import time
+_TEST_OFFSETS = tuple(
+    (offset, description, f"Offset {offset:3d} (0x{offset:02X}) - {description:20s}")
+    for offset, description in (
+        (FAN1_OFFSET, "Fan 1 Speed Control"),
+        (FAN2_OFFSET, "Fan 2 Speed Control"),
+        (BIOS_OFFSET, "BIOS Control Status"),
+        (TIMER_OFFSET, "Timer Value"),
+        (CPU_TEMP_OFFSET, "CPU Temperature"),
+        (GPU_TEMP_OFFSET, "GPU Temperature"),
+        (BOOST_OFFSET, "Boost Control"),
+    )
+)
+
 # File paths
 ECIO_FILE = "/sys/kernel/debug/ec/ec0/io"
 DEVICE_FILE = "/sys/devices/virtual/dmi/id/product_name"
+MODULES_FILE = "/proc/modules"
+
+# Known supported devices (substring match against the DMI product name)
+_SUPPORTED = ("OMEN by HP Laptop 16",)
+
+HWMON_DIR_GLOB = "/sys/devices/platform/hp-wmi/hwmon/*"
+
+# EC file descriptor, opened read-only once and shared by all EC reads
+_ec_fd = None
+
+# Accepted answers for yes/no prompts
+_YES = frozenset({"y", "yes"})
+_NO = frozenset({"n", "no", ""})
+
+
+def ask_yes_no(prompt):
+    """Prompt until the user answers yes or no; an empty answer means no"""
+    indent = prompt[:len(prompt) - len(prompt.lstrip())]
+    while True:
+        response = input(prompt).strip().lower()
+        if response in _YES:
+            return True
+        if response in _NO:
+            return False
+        print(f"{indent}Please answer 'y' for yes or 'n' for no.")
 
 
 def check_root_access():
@@ -42,23 +87,39 @@ def check_root_access():
     return True
 
 
+def is_ec_module_loaded():
+    """Check /proc/modules for ec_sys without spawning lsmod"""
+    with open(MODULES_FILE, "r") as f:
+        return any(line.startswith("ec_sys ") for line in f)
+
+
 def load_ec_module():
     """Load the ec_sys kernel module for EC access"""
     try:
         # Check if module is already loaded
-        result = subprocess.run(["lsmod"], capture_output=True, text=True)
-        if "ec_sys" not in result.stdout:
+        if not is_ec_module_loaded():
             print("Loading ec_sys module...")
             subprocess.run(["modprobe", "ec_sys", "write_support=1"], check=True)
             print("✓ ec_sys module loaded successfully")
         else:
             print("✓ ec_sys module already loaded")
         return True
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, OSError) as e:
         print(f"ERROR: Failed to load ec_sys module: {e}")
         return False
 
 
+def wait_for_ec_interface():
+    """Poll until ec_sys exposes the EC interface, up to EC_READY_TIMEOUT"""
+    deadline = monotonic() + EC_READY_TIMEOUT
+    while not os.path.exists(ECIO_FILE):
+        if monotonic() >= deadline:
+            return False
+        sleep(0.01)
+    return True
+
+
+@functools.lru_cache(maxsize=None)
 def check_device_compatibility():
     """Check if the device is in the supported list"""
     try:
@@ -66,10 +127,7 @@ def check_device_compatibility():
             device_name = f.read().strip()
         print(f"Device name: {device_name}")
         
-        # Known supported devices
-        supported = ["OMEN by HP Laptop 16"]
-        
-        is_supported = any(supported_device in device_name for supported_device in supported)
+        is_supported = any(supported_device in device_name for supported_device in _SUPPORTED)
         if is_supported:
             print("✓ Device appears to be in supported list")
         else:
@@ -82,15 +140,18 @@ def check_device_compatibility():
         return None
 
 
+@functools.lru_cache(maxsize=None)
 def check_ec_interface():
     """Check if EC interface is accessible"""
     try:
-        if not os.path.exists(ECIO_FILE):
+        # A single stat both confirms the file exists and reports its mode
+        try:
+            stat = os.stat(ECIO_FILE)
+        except FileNotFoundError:
             print("ERROR: EC interface file not found")
             return False
         
         # Check permissions
-        stat = os.stat(ECIO_FILE)
         if not (stat.st_mode & 0o200):  # Check write permission for root
             print("WARNING: EC interface may not have write support")
         
@@ -101,11 +162,12 @@ def check_ec_interface():
         return False
 
 
+@functools.lru_cache(maxsize=None)
 def check_hp_wmi_interface():
     """Check HP WMI hwmon interface availability"""
     try:
-        fan_files = glob.glob("/sys/devices/platform/hp-wmi/hwmon/*/fan*_input")
-        boost_files = glob.glob("/sys/devices/platform/hp-wmi/hwmon/*/pwm1_enable")
+        fan_files = glob.glob(f"{HWMON_DIR_GLOB}/fan*_input")
+        boost_files = glob.glob(f"{HWMON_DIR_GLOB}/pwm1_enable")
         
         if fan_files:
             print(f"✓ Found HP WMI fan interfaces: {len(fan_files)} fans")
@@ -136,51 +198,62 @@ def check_hp_wmi_interface():
         return False
 
 
+def _get_ec_fd():
+    """Return the shared read-only EC file descriptor, opening it on first use"""
+    global _ec_fd
+    if _ec_fd is None:
+        _ec_fd = os.open(ECIO_FILE, os.O_RDONLY)
+        # Access is random single bytes within a tiny range; no-op on debugfs
+        try:
+            os.posix_fadvise(_ec_fd, 0, EC_SIZE, os.POSIX_FADV_RANDOM)
+        except (AttributeError, OSError):
+            pass
+    return _ec_fd
+
+
+def _close_ec_fd():
+    """Close the shared EC file descriptor if it is open"""
+    global _ec_fd
+    if _ec_fd is not None:
+        os.close(_ec_fd)
+        _ec_fd = None
+
+
+atexit.register(_close_ec_fd)
+
+
 def read_ec_byte(offset):
     """Safely read a single byte from EC at given offset"""
     try:
-        with open(ECIO_FILE, "rb") as ec:
-            ec.seek(offset)
-            byte_data = ec.read(1)
-            if byte_data:
-                return int.from_bytes(byte_data, "big")
-            else:
-                return None
+        byte_data = os.pread(_get_ec_fd(), 1, offset)
+        if byte_data:
+            return byte_data[0]
+        return None
     except Exception as e:
         print(f"ERROR reading EC offset {offset} (0x{offset:02X}): {e}")
         return None
 
 
+@functools.lru_cache(maxsize=None)
 def test_ec_read_capabilities():
     """Test reading various EC memory locations"""
     print("\n" + "="*50)
     print("TESTING EC READ CAPABILITIES")
     print("="*50)
     
-    # Test critical offsets
-    test_offsets = [
-        (FAN1_OFFSET, "Fan 1 Speed Control"),
-        (FAN2_OFFSET, "Fan 2 Speed Control"), 
-        (BIOS_OFFSET, "BIOS Control Status"),
-        (TIMER_OFFSET, "Timer Value"),
-        (CPU_TEMP_OFFSET, "CPU Temperature"),
-        (GPU_TEMP_OFFSET, "GPU Temperature"),
-        (BOOST_OFFSET, "Boost Control")
-    ]
-    
     successful_reads = 0
     
-    for offset, description in test_offsets:
+    for offset, _, prefix in _TEST_OFFSETS:
         value = read_ec_byte(offset)
         if value is not None:
-            print(f"✓ Offset {offset:3d} (0x{offset:02X}) - {description:20s}: {value:3d} (0x{value:02X})")
+            print(f"✓ {prefix}: {value:3d} (0x{value:02X})")
             successful_reads += 1
         else:
-            print(f"✗ Offset {offset:3d} (0x{offset:02X}) - {description:20s}: READ FAILED")
+            print(f"✗ {prefix}: READ FAILED")
     
-    print(f"\nSUMMARY: {successful_reads}/{len(test_offsets)} offsets readable")
+    print(f"\nSUMMARY: {successful_reads}/{len(_TEST_OFFSETS)} offsets readable")
     
-    return successful_reads == len(test_offsets)
+    return successful_reads == len(_TEST_OFFSETS)
 
 
 def analyze_current_state():
@@ -232,7 +305,7 @@ def compatibility_report():
     print("Based on the tests performed:")
     print()
     
-    # Check if all tests passed
+    # Check if all tests passed (results are cached from the earlier run)
     device_ok = check_device_compatibility() is not None
     ec_ok = check_ec_interface()
     hp_wmi_ok = check_hp_wmi_interface()
@@ -253,24 +326,17 @@ def compatibility_report():
         print("   - Small chance of requiring BIOS reset")
         print()
         
-        while True:
-            response = input("Do you want to proceed to the risky write test? (y/N): ").lower()
-            if response in ['n', 'no', '']:
-                print("\n✓ Wise choice! You can run ec_write_test.py manually later if desired.")
-                break
-            elif response in ['y', 'yes']:
-                print("\n⚠ Proceeding to write test...")
-                print("   Loading ec_write_test.py...")
-                print("   (You'll get more detailed warnings in that script)")
-                try:
-                    import subprocess
-                    subprocess.run([sys.executable, "ec_write_test.py"], check=False)
-                except Exception as e:
-                    print(f"Could not launch write test: {e}")
-                    print("You can run it manually: sudo python3 ec_write_test.py")
-                break
-            else:
-                print("Please answer 'y' for yes or 'n' for no.")
+        if ask_yes_no("Do you want to proceed to the risky write test? (y/N): "):
+            print("\n⚠ Proceeding to write test...")
+            print("   Loading ec_write_test.py...")
+            print("   (You'll get more detailed warnings in that script)")
+            try:
+                subprocess.run([sys.executable, "ec_write_test.py"], check=False)
+            except Exception as e:
+                print(f"Could not launch write test: {e}")
+                print("You can run it manually: sudo python3 ec_write_test.py")
+        else:
+            print("\n✓ Wise choice! You can run ec_write_test.py manually later if desired.")
                 
     elif ec_ok and ec_read_ok:
         print("🟡 POSSIBLY COMPATIBLE: Core functionality present")
@@ -291,6 +357,11 @@ def main():
     """Main test execution"""
     print("OMEN Fan Control - Hardware Compatibility Check")
     print("===============================================")
+    
+    # Fail fast before the prompt if we can't access the EC at all
+    if not check_root_access():
+        return 1
+    
     print("🟢 RISK LEVEL: Should be very safe (but no guarantees)")
     print("   - Only READS from system - no changes planned")
     print("   - Should not damage hardware or affect fan control")
@@ -305,30 +376,23 @@ def main():
     print()
     
     # Get user confirmation
-    while True:
-        response = input("Do you want to proceed with the read-only compatibility check? (y/N): ").lower()
-        if response in ['n', 'no', '']:
-            print("Test cancelled by user.")
-            return 1
-        elif response in ['y', 'yes']:
-            break
-        else:
-            print("Please answer 'y' for yes or 'n' for no.")
+    if not ask_yes_no("Do you want to proceed with the read-only compatibility check? (y/N): "):
+        print("Test cancelled by user.")
+        return 1
     
     print("\n" + "="*50)
     print("STARTING COMPATIBILITY TESTS...")
     print("="*50)
     
     # Prerequisites check
-    if not check_root_access():
-        return 1
-    
     if not load_ec_module():
         print("Cannot proceed without EC module")
         return 1
     
-    # Wait a moment for module to initialize
-    sleep(0.5)
+    # Wait for the module to expose the EC interface
+    if not wait_for_ec_interface():
+        print("ERROR: EC interface did not appear after loading ec_sys")
+        return 1
     
     # Run compatibility tests
     print("\n" + "="*50)
@@ -28,8 +28,10 @@ SAFETY FEATURES:
 import os
 import sys
 import time
+import atexit
 import signal
 import subprocess
+import glob
 from time import sleep
 
 # EC Memory offsets
@@ -39,14 +41,19 @@ BIOS_OFFSET = 98      # 0x62
 TIMER_OFFSET = 99     # 0x63
 CPU_TEMP_OFFSET = 87  # 0x57
 GPU_TEMP_OFFSET = 183 # 0xB7
+EC_SIZE = 256         # Size of the EC register space
 
 # File paths
 ECIO_FILE = "/sys/kernel/debug/ec/ec0/io"
+HWMON_DIR_GLOB = "/sys/devices/platform/hp-wmi/hwmon/*"
+MODULES_FILE = "/proc/modules"
 
 # Safety limits
 MAX_SAFE_TEMP = 85    # Maximum safe temperature
 MIN_FAN_SPEED = 30    # Minimum fan speed to test (safe)
 TEST_DURATION = 10    # Test duration in seconds
+EC_READY_TIMEOUT = 1.0  # Seconds to wait for the EC interface after modprobe
+MONITOR_RT_PRIORITY = 10  # SCHED_RR priority while BIOS fan control is off
 
 # Global variables for cleanup
 original_bios_control = None
@@ -54,14 +61,34 @@ original_fan1_speed = None
 original_fan2_speed = None
 original_timer = None
 
+# EC file descriptor, opened once and shared by all EC accesses
+_ec_fd = None
+
+# Accepted answers for yes/no prompts
+_YES = frozenset({"y", "yes"})
+_NO = frozenset({"n", "no", ""})
+
 
 def signal_handler(signum, frame):
     """Handle Ctrl+C gracefully"""
     print("\n\nEmergency shutdown requested!")
     restore_original_state()
+    _close_ec_fd()
     sys.exit(0)
 
 
+def ask_yes_no(prompt):
+    """Prompt until the user answers yes or no; an empty answer means no"""
+    indent = prompt[:len(prompt) - len(prompt.lstrip())]
+    while True:
+        response = input(prompt).strip().lower()
+        if response in _YES:
+            return True
+        if response in _NO:
+            return False
+        print(f"{indent}Please answer 'y' for yes or 'n' for no.")
+
+
 def check_root_access():
     """Check if running as root"""
     if os.geteuid() != 0:
@@ -71,29 +98,82 @@ def check_root_access():
     return True
 
 
+def _get_ec_fd():
+    """Return the shared EC file descriptor, opening it on first use"""
+    global _ec_fd
+    if _ec_fd is None:
+        _ec_fd = os.open(ECIO_FILE, os.O_RDWR)
+        # Access is random single bytes within a tiny range; no-op on debugfs
+        try:
+            os.posix_fadvise(_ec_fd, 0, EC_SIZE, os.POSIX_FADV_RANDOM)
+        except (AttributeError, OSError):
+            pass
+    return _ec_fd
+
+
+def _close_ec_fd():
+    """Close the shared EC file descriptor if it is open"""
+    global _ec_fd
+    if _ec_fd is not None:
+        os.close(_ec_fd)
+        _ec_fd = None
+
+
+atexit.register(_close_ec_fd)
+
+
+def is_ec_module_loaded():
+    """Check /proc/modules for ec_sys without spawning lsmod"""
+    with open(MODULES_FILE, "r") as f:
+        return any(line.startswith("ec_sys ") for line in f)
+
+
+def wait_for_ec_interface():
+    """Poll until ec_sys exposes the EC interface, up to EC_READY_TIMEOUT"""
+    deadline = time.monotonic() + EC_READY_TIMEOUT
+    while not os.path.exists(ECIO_FILE):
+        if time.monotonic() >= deadline:
+            return False
+        sleep(0.01)
+    return True
+
+
 def read_ec_byte(offset):
     """Read a byte from EC"""
     try:
-        with open(ECIO_FILE, "rb") as ec:
-            ec.seek(offset)
-            return int.from_bytes(ec.read(1), "big")
+        return os.pread(_get_ec_fd(), 1, offset)[0]
     except Exception as e:
         print(f"ERROR reading offset {offset}: {e}")
         return None
 
 
-def write_ec_byte(offset, value):
-    """Write a byte to EC"""
+def read_ec_bytes(offset, length):
+    """Read consecutive bytes from EC starting at offset"""
     try:
-        with open(ECIO_FILE, "r+b") as ec:
-            ec.seek(offset)
-            ec.write(bytes([value]))
+        data = os.pread(_get_ec_fd(), length, offset)
+        if len(data) == length:
+            return data
+        print(f"ERROR: Short EC read at offset {offset} ({len(data)}/{length} bytes)")
+    except Exception as e:
+        print(f"ERROR reading offset {offset}: {e}")
+    return None
+
+
+def write_ec_bytes(offset, data):
+    """Write consecutive bytes to EC starting at offset"""
+    try:
+        os.pwrite(_get_ec_fd(), data, offset)
         return True
     except Exception as e:
         print(f"ERROR writing to offset {offset}: {e}")
         return False
 
 
+def write_ec_byte(offset, value):
+    """Write a byte to EC"""
+    return write_ec_bytes(offset, bytes((value,)))
+
+
 def get_temperatures():
     """Get current CPU and GPU temperatures"""
     cpu_temp = read_ec_byte(CPU_TEMP_OFFSET)
@@ -101,9 +181,13 @@ def get_temperatures():
     return cpu_temp, gpu_temp
 
 
-def check_temperature_safety():
-    """Check if temperatures are within safe limits"""
-    cpu_temp, gpu_temp = get_temperatures()
+def check_temperature_safety(temps=None):
+    """Check if temperatures are within safe limits
+
+    temps may be a (cpu_temp, gpu_temp) pair already read by the caller;
+    otherwise the temperatures are read from the EC.
+    """
+    cpu_temp, gpu_temp = temps if temps is not None else get_temperatures()
     max_temp = max(cpu_temp or 0, gpu_temp or 0)
     
     if max_temp > MAX_SAFE_TEMP:
@@ -118,10 +202,13 @@ def save_original_state():
     global original_bios_control, original_fan1_speed, original_fan2_speed, original_timer
     
     print("Saving original EC state...")
-    original_bios_control = read_ec_byte(BIOS_OFFSET)
-    original_fan1_speed = read_ec_byte(FAN1_OFFSET)
-    original_fan2_speed = read_ec_byte(FAN2_OFFSET)
-    original_timer = read_ec_byte(TIMER_OFFSET)
+    # FAN1/FAN2 and BIOS/TIMER are adjacent, so each pair is one read
+    fans = read_ec_bytes(FAN1_OFFSET, 2)
+    bios = read_ec_bytes(BIOS_OFFSET, 2)
+    if fans is not None:
+        original_fan1_speed, original_fan2_speed = fans
+    if bios is not None:
+        original_bios_control, original_timer = bios
     
     print(f"  BIOS Control: {original_bios_control}")
     print(f"  Fan 1 Speed: {original_fan1_speed}")
@@ -133,11 +220,11 @@ def restore_original_state():
     """Restore original EC state"""
     if None not in [original_bios_control, original_fan1_speed, original_fan2_speed, original_timer]:
         print("Restoring original EC state...")
-        write_ec_byte(BIOS_OFFSET, original_bios_control)
-        write_ec_byte(FAN1_OFFSET, original_fan1_speed)
-        write_ec_byte(FAN2_OFFSET, original_fan2_speed)
-        write_ec_byte(TIMER_OFFSET, original_timer)
-        print("✓ Original state restored")
+        # FAN1/FAN2 and BIOS/TIMER are adjacent, so each pair is one write
+        bios_ok = write_ec_bytes(BIOS_OFFSET, bytes((original_bios_control, original_timer)))
+        fans_ok = write_ec_bytes(FAN1_OFFSET, bytes((original_fan1_speed, original_fan2_speed)))
+        if bios_ok and fans_ok:
+            print("✓ Original state restored")
     else:
         print("⚠ Cannot restore state - original values not saved properly")
 
@@ -182,6 +269,27 @@ def test_bios_control():
     return True
 
 
+def raise_monitor_priority():
+    """Run as SCHED_RR during monitoring; return the previous policy or None"""
+    try:
+        previous = (os.sched_getscheduler(0), os.sched_getparam(0))
+        os.sched_setscheduler(0, os.SCHED_RR, os.sched_param(MONITOR_RT_PRIORITY))
+        return previous
+    except (AttributeError, OSError) as e:
+        print(f"      ⚠ Could not raise monitor priority: {e}")
+        return None
+
+
+def restore_monitor_priority(previous):
+    """Restore the scheduling policy saved by raise_monitor_priority"""
+    if previous is None:
+        return
+    try:
+        os.sched_setscheduler(0, *previous)
+    except OSError as e:
+        print(f"      ⚠ Could not restore scheduling policy: {e}")
+
+
 def test_fan_speed_control():
     """Test fan speed control"""
     # Disable BIOS control first
@@ -206,19 +314,35 @@ def test_fan_speed_control():
         
         # Monitor for a few seconds
         print(f"      → Monitoring for {TEST_DURATION} seconds...")
-        for i in range(TEST_DURATION):
-            if not check_temperature_safety():
-                print("      ❌ Temperature safety limit exceeded!")
-                restore_original_state()
-                return False
-            
-            fan1_val = read_ec_byte(FAN1_OFFSET)
-            fan2_val = read_ec_byte(FAN2_OFFSET)
-            cpu_temp, gpu_temp = get_temperatures()
-            
-            print(f"        {i+1:2d}s: Fan1={fan1_val:3d}, Fan2={fan2_val:3d}, "
-                  f"CPU={cpu_temp:2d}°C, GPU={gpu_temp:2d}°C")
-            sleep(1)
+        # Ticks are scheduled against a monotonic start time so slow EC reads
+        # don't stretch the test, and a failed check exits without sleeping
+        previous_sched = raise_monitor_priority()
+        try:
+            start = time.monotonic()
+            deadline = start + TEST_DURATION
+            i = 0
+            while time.monotonic() < deadline:
+                i += 1
+                # ec_sys serves reads one byte at a time, so only fetch the
+                # registers shown: the adjacent fan pair and both temperatures
+                fans = read_ec_bytes(FAN1_OFFSET, 2)
+                cpu_temp = read_ec_byte(CPU_TEMP_OFFSET)
+                gpu_temp = read_ec_byte(GPU_TEMP_OFFSET)
+                if fans is None or cpu_temp is None or gpu_temp is None:
+                    print("      ✗ Lost EC read access during monitoring")
+                    return False
+                fan1_val, fan2_val = fans
+                
+                if not check_temperature_safety((cpu_temp, gpu_temp)):
+                    print("      ❌ Temperature safety limit exceeded!")
+                    restore_original_state()
+                    return False
+                
+                print(f"        {i:2d}s: Fan1={fan1_val:3d}, Fan2={fan2_val:3d}, "
+                      f"CPU={cpu_temp:2d}°C, GPU={gpu_temp:2d}°C")
+                sleep(max(0, start + i - time.monotonic()))
+        finally:
+            restore_monitor_priority(previous_sched)
         
         print("      ✓ Fan speed control test completed successfully")
         return True
@@ -230,9 +354,8 @@ def test_fan_speed_control():
 def get_hp_wmi_fan_speeds():
     """Get actual fan RPM from HP WMI interface"""
     try:
-        import glob
-        fan1_file = glob.glob("/sys/devices/platform/hp-wmi/hwmon/*/fan1_input")[0]
-        fan2_file = glob.glob("/sys/devices/platform/hp-wmi/hwmon/*/fan2_input")[0]
+        fan1_file = glob.glob(f"{HWMON_DIR_GLOB}/fan1_input")[0]
+        fan2_file = glob.glob(f"{HWMON_DIR_GLOB}/fan2_input")[0]
         
         with open(fan1_file, 'r') as f:
             fan1_rpm = int(f.read().strip())
@@ -287,10 +410,6 @@ def comprehensive_test():
         print("❌ Temperature too high to safely proceed")
         return False
     
-    # Initial safety checks
-    if not check_temperature_safety():
-        return False
-    
     # Get informed consent
     print("⚠️ UNDERSTANDING THE RISKS:")
     print("   → This test will modify your laptop's fan control system")
@@ -299,15 +418,9 @@ def comprehensive_test():
     print("   → Very small chance of permanent damage")
     print()
     
-    while True:
-        response = input("Do you understand the risks and want to proceed? (y/N): ").lower()
-        if response in ['n', 'no', '']:
-            print("Test cancelled by user - wise choice!")
-            return False
-        elif response in ['y', 'yes']:
-            break
-        else:
-            print("Please answer 'y' for yes or 'n' for no.")
+    if not ask_yes_no("Do you understand the risks and want to proceed? (y/N): "):
+        print("Test cancelled by user - wise choice!")
+        return False
     
     while True:
         confirm = input("\nFinal confirmation - Type 'I UNDERSTAND THE RISKS' to proceed: ")
@@ -350,18 +463,12 @@ def comprehensive_test():
         print("   → Will set fans to 20% speed for 10 seconds")
         print("   → Temperature monitored continuously")
         
-        while True:
-            response = input("   Continue with fan speed test? (y/N): ").lower()
-            if response in ['n', 'no', '']:
-                print("   Skipping fan speed test")
-                restore_original_state()
-                print("   ✓ Original state restored")
-                print("\n🟡 PARTIAL SUCCESS: BIOS control works, fan speed test skipped")
-                return True
-            elif response in ['y', 'yes']:
-                break
-            else:
-                print("   Please answer 'y' for yes or 'n' for no.")
+        if not ask_yes_no("   Continue with fan speed test? (y/N): "):
+            print("   Skipping fan speed test")
+            restore_original_state()
+            print("   ✓ Original state restored")
+            print("\n🟡 PARTIAL SUCCESS: BIOS control works, fan speed test skipped")
+            return True
         
         print("   → Starting fan speed test...")
         if not test_fan_speed_control():
@@ -430,13 +537,16 @@ def main():
     
     # Load EC module if needed
     try:
-        result = subprocess.run(["lsmod"], capture_output=True, text=True)
-        if "ec_sys" not in result.stdout:
+        if not is_ec_module_loaded():
             subprocess.run(["modprobe", "ec_sys", "write_support=1"], check=True)
     except:
         print("ERROR: Cannot load ec_sys module")
         return 1
     
+    if not wait_for_ec_interface():
+        print("ERROR: EC interface did not appear after loading ec_sys")
+        return 1
+    
     success = comprehensive_test()
     return 0 if success else 1
 
@@ -16,6 +16,7 @@ ECIO_FILE = "/sys/kernel/debug/ec/ec0/io"
 IPC_FILE = "/tmp/omen-fand.PID"
 DEVICE_FILE = "/sys/devices/virtual/dmi/id/product_name"
 CONFIG_FILE = "/etc/omen-fan/config.toml"
+MODULES_FILE = "/proc/modules"
 BOOST_FILE = glob.glob("/sys/devices/platform/hp-wmi/hwmon/*/pwm1_enable")[0]
 FAN1_SPEED_FILE = glob.glob("/sys/devices/platform/hp-wmi/hwmon/*/fan1_input")[0]
 FAN2_SPEED_FILE = glob.glob("/sys/devices/platform/hp-wmi/hwmon/*/fan2_input")[0]
@@ -99,8 +100,13 @@ def startup_check():
             sys.exit(1)
 
 
+def is_ec_module_loaded():
+    with open(MODULES_FILE, "r", encoding="utf-8") as modules:
+        return any(line.startswith("ec_sys ") for line in modules)
+
+
 def load_ec_module():
-    if "ec_sys" not in str(subprocess.check_output("lsmod")):
+    if not is_ec_module_loaded():
         subprocess.run(["modprobe", "ec_sys", "write_support=1"], check=True)
 
     if not bool(os.stat(ECIO_FILE).st_mode & 0o200):
@@ -211,7 +217,11 @@ def boost_cli(arg):
     help="Comma-separated list of speed curve values",
 )
 @click.option("--idle-speed", type=click.IntRange(0, 100), help="Idle fan speed value")
-@click.option("--poll-interval", type=click.FLOAT, help="Poll interval in seconds")
+@click.option(
+    "--poll-interval",
+    type=click.FloatRange(min=0.25),
+    help="Poll interval in seconds (min 0.25)",
+)
 @click.option(
     "--speed-cooldown",
     type=click.IntRange(1, 300),
@@ -340,7 +350,7 @@ def info_cli():
             load_ec_module()
             with open(ECIO_FILE, "rb") as ec:
                 ec.seek(BIOS_OFFSET)
-                if int.from_bytes(ec.read(1), "big") == 6:
+                if ec.read(1)[0] == 6:
                     print("  BIOS Control : Disabled")
                 else:
                     print("  BIOS Control : Enabled")
@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
 import os
+import mmap
 import signal
+import selectors
 import sys
-from time import sleep, time, strftime
-import tomlkit
+from time import sleep, time, monotonic, strftime, localtime
 from bisect import bisect_left
 
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    tomllib = None
+    import tomlkit
+
 ECIO_FILE = "/sys/kernel/debug/ec/ec0/io"
 IPC_FILE = "/tmp/omen-fand.PID"
 LOG_FILE = "/tmp/omen-fand.log"
@@ -18,41 +25,32 @@ BIOS_OFFSET = 98  # 0x62
 TIMER_OFFSET = 99  # 0x63
 CPU_TEMP_OFFSET = 87  # 0x57
 GPU_TEMP_OFFSET = 183  # 0xB7
+EC_SIZE = 256
 
 FAN1_MAX = 50
 FAN2_MAX = 50
 
-with open(CONFIG_FILE, "r") as file:
-    doc = tomlkit.loads(file.read())
-    TEMP_CURVE = doc["service"]["TEMP_CURVE"].unwrap()
-    SPEED_CURVE = doc["service"]["SPEED_CURVE"].unwrap()
-    IDLE_SPEED = doc["service"]["IDLE_SPEED"].unwrap()
-    POLL_INTERVAL = doc["service"]["POLL_INTERVAL"].unwrap()
+# EC payloads for each 5% speed step, written to FAN1_OFFSET and the
+# adjacent FAN2_OFFSET in one go
+FAN_TABLE = [
+    bytes((FAN1_MAX * speed // 100, FAN2_MAX * speed // 100))
+    for speed in range(0, 101, 5)
+]
 
-    # Get cooldown period from config, default to 15 seconds if not set
-    SPEED_COOLDOWN = doc["service"].get("SPEED_COOLDOWN", 15)
+# Fixed EC payloads for bios_control, built once rather than per call
+BIOS_MANUAL = b"\x06"  # BIOS fan control disabled
+BIOS_AUTO = b"\x00"  # BIOS fan control enabled
+TIMER_RESET = b"\x00"
 
-    # Get smoothing and deadband settings
-    SPEED_SMOOTHING = doc["service"].get(
-        "SPEED_SMOOTHING", 0.3
-    )  # Smoothing factor (0.1-1.0)
-    SPEED_DEADBAND = doc["service"].get(
-        "SPEED_DEADBAND", 3
-    )  # Minimum % change to adjust
+# Polling faster than this only adds wakeups; a thermal loop gains nothing
+MIN_POLL_INTERVAL = 0.25
 
-    # Get logging settings
-    ENABLE_LOGGING = doc["service"].get(
-        "ENABLE_LOGGING", False
-    )  # Enable detailed logging
-    LOG_INTERVAL = doc["service"].get("LOG_INTERVAL", 5)  # Log every N seconds
+# Seconds between re-disabling BIOS fan control; well inside the EC timer
+BIOS_REFRESH_INTERVAL = 4
 
-# Precalculate slopes to reduce compute time.
-slope = []
-for i in range(1, len(TEMP_CURVE)):
-    speed_diff = SPEED_CURVE[i] - SPEED_CURVE[i - 1]
-    temp_diff = TEMP_CURVE[i] - TEMP_CURVE[i - 1]
-    slope_val = round(speed_diff / temp_diff, 2)
-    slope.append(slope_val)
+# Speeds are tracked as integer tenths of a percent (0-1000) and smoothed
+# with a fixed-point factor of alpha_num / ALPHA_DEN
+ALPHA_DEN = 256
 
 
 def is_root():
@@ -62,164 +60,336 @@ def is_root():
         sys.exit(1)
 
 
-def sig_handler(signum, frame):
-    log_message("Service stopped")
-    os.remove(IPC_FILE)
-    if os.path.exists(LOG_FILE):
-        os.remove(LOG_FILE)
-    bios_control(True)
-    sys.exit()
+def load_config():
+    """Return the [service] table of the config as plain Python types"""
+    # The service only reads the config, so there is no need for tomlkit
+    with open(CONFIG_FILE, "rb") as file:
+        if tomllib is not None:
+            doc = tomllib.load(file)
+        else:
+            doc = tomlkit.loads(file.read().decode("utf-8")).unwrap()
+    return doc["service"]
+
+
+def build_target_lut(temp_curve, speed_curve, idle_speed):
+    """Evaluate the fan curve for every possible EC temperature reading
+
+    EC temperatures are whole degrees in a single byte, so the result is
+    indexed by temperature and holds speeds in tenths of a percent.
+    """
+    # Precalculate each curve segment as (start temp, start speed, slope) so
+    # an interpolation is one bisect and one tuple unpack.
+    segments = [
+        (t0, s0, round((s1 - s0) / (t1 - t0), 2))
+        for t0, t1, s0, s1 in zip(
+            temp_curve, temp_curve[1:], speed_curve, speed_curve[1:]
+        )
+    ]
+    seg_ends = temp_curve[1:]
+
+    target_lut = []
+    for t in range(EC_SIZE):
+        if t <= temp_curve[0]:
+            v = idle_speed
+        elif t >= temp_curve[-1]:
+            v = speed_curve[-1]
+        else:
+            x0, y0, m = segments[bisect_left(seg_ends, t)]
+            v = y0 + m * (t - x0)
+        target_lut.append(round(v * 10))
+    return target_lut
 
 
-def update_fan(speed1, speed2):
-    with open(ECIO_FILE, "r+b") as ec:
-        ec.seek(FAN1_OFFSET)
-        ec.write(bytes([int(speed1)]))
-        ec.seek(FAN2_OFFSET)
-        ec.write(bytes([int(speed2)]))
+def main():
+    # Everything the loop touches lives in this function's scope, so lookups
+    # in the hot path are fast locals and closure cells rather than globals.
+    is_root()
 
+    service = load_config()
+    temp_curve = service["TEMP_CURVE"]
+    speed_curve = service["SPEED_CURVE"]
+    idle_speed = service["IDLE_SPEED"]
+    poll_interval = max(MIN_POLL_INTERVAL, float(service["POLL_INTERVAL"]))
 
-def log_message(message):
-    """Write a timestamped message to the log file"""
-    if ENABLE_LOGGING:
-        timestamp = strftime("%Y-%m-%d %H:%M:%S")
-        try:
-            with open(LOG_FILE, "a", encoding="utf-8") as log:
-                log.write(f"[{timestamp}] {message}\n")
-                log.flush()  # Ensure immediate write
-        except Exception:
-            pass  # Fail silently if logging fails
+    # Get cooldown period from config, default to 15 seconds if not set
+    speed_cooldown = service.get("SPEED_COOLDOWN", 15)
+
+    # Get smoothing and deadband settings
+    speed_smoothing = service.get("SPEED_SMOOTHING", 0.3)  # Smoothing factor (0.1-1.0)
+    speed_deadband = service.get("SPEED_DEADBAND", 3)  # Minimum % change to adjust
+
+    # Get logging settings
+    enable_logging = service.get("ENABLE_LOGGING", False)  # Enable detailed logging
+    log_interval = service.get("LOG_INTERVAL", 5)  # Log every N seconds
 
+    alpha_num = max(1, round(speed_smoothing * ALPHA_DEN))
+    deadband_tenths = speed_deadband * 10
+    target_lut = build_target_lut(temp_curve, speed_curve, idle_speed)
 
-def get_temp():
-    with open(ECIO_FILE, "rb") as ec:
-        ec.seek(CPU_TEMP_OFFSET)
-        temp_c = int.from_bytes(ec.read(1), "big")
-        ec.seek(GPU_TEMP_OFFSET)
-        temp_g = int.from_bytes(ec.read(1), "big")
-    return temp_c, temp_g, max(temp_c, temp_g)
-
-
-def bios_control(enabled):
-    if enabled is False:
-        with open(ECIO_FILE, "r+b") as ec:
-            ec.seek(BIOS_OFFSET)
-            ec.write(bytes([6]))
-            sleep(0.1)
-            ec.seek(TIMER_OFFSET)
-            ec.write(bytes([0]))
-    elif enabled is True:
-        with open(ECIO_FILE, "r+b") as ec:
-            ec.seek(BIOS_OFFSET)
-            ec.write(bytes([0]))
-            ec.seek(FAN1_OFFSET)
-            ec.write(bytes([0]))
-            ec.seek(FAN2_OFFSET)
-            ec.write(bytes([0]))
-
-
-signal.signal(signal.SIGTERM, sig_handler)
-
-with open(IPC_FILE, "w", encoding="utf-8") as ipc:
-    ipc.write(str(os.getpid()))
-
-# Clear previous log file
-if os.path.exists(LOG_FILE):
-    os.remove(LOG_FILE)
-
-speed_old = -1
-last_speed_increase_time = 0  # Track when we last increased speed
-current_speed = 0  # Track current applied speed for hysteresis
-smoothed_speed = 0  # Track smoothed speed to reduce oscillation
-last_log_time = 0  # Track when we last logged
-is_root()
-
-log_message(f"Service started - PID: {os.getpid()}")
-log_message(f"Config: TEMP_CURVE={TEMP_CURVE}, SPEED_CURVE={SPEED_CURVE}")
-log_message(
-    f"Settings: COOLDOWN={SPEED_COOLDOWN}s, SMOOTHING={SPEED_SMOOTHING}, DEADBAND={SPEED_DEADBAND}%"
-)
-
-while True:
-    cpu_temp, gpu_temp, temp = get_temp()
-    current_time = time()
-
-    # Calculate target speed based on temperature curve
-    if temp <= TEMP_CURVE[0]:
-        target_speed = IDLE_SPEED
-    elif temp >= TEMP_CURVE[-1]:
-        target_speed = SPEED_CURVE[-1]
-    else:
-        i = bisect_left(TEMP_CURVE, temp)
-        y0 = SPEED_CURVE[i - 1]
-        x0 = TEMP_CURVE[i - 1]
-        target_speed = y0 + slope[i - 1] * (temp - x0)
-
-    # Apply exponential smoothing to reduce rapid changes
-    if smoothed_speed == 0:
-        # First iteration - initialize smoothed speed
-        smoothed_speed = target_speed
-    else:
-        # Smooth the target speed to reduce oscillation
-        smoothed_speed = (SPEED_SMOOTHING * target_speed) + (
-            (1 - SPEED_SMOOTHING) * smoothed_speed
+    # Keep the EC open for the lifetime of the service; all access is positional
+    ec_fd = os.open(ECIO_FILE, os.O_RDWR)
+
+    # Map the EC so register access needs no syscalls. The debugfs node from
+    # ec_sys may not implement mmap, in which case we stay on pread/pwrite.
+    try:
+        ec_mm = mmap.mmap(
+            ec_fd, EC_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE
         )
+    except (OSError, ValueError):
+        ec_mm = None
+
+    # Signals also write to this pipe, so a pending signal wakes the poll wait
+    # immediately instead of after the rest of the poll interval
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    poll_selector = selectors.DefaultSelector()
+    poll_selector.register(wake_r, selectors.EVENT_READ)
+
+    # Clear previous log file
+    if os.path.exists(LOG_FILE):
+        os.remove(LOG_FILE)
+
+    # Keep the log open; line buffering flushes each message as it is written
+    log_fh = None
+    if enable_logging:
+        try:
+            log_fh = open(LOG_FILE, "a", encoding="utf-8", buffering=1)
+        except OSError:
+            pass  # Fail silently if logging fails
 
-    # Hysteresis logic: Always allow speed increases, but delay decreases
-    hysteresis_action = ""
-    if smoothed_speed > current_speed:
-        # Speed increase - always allow immediately
-        proposed_speed = smoothed_speed
-        last_speed_increase_time = current_time
-        current_speed = proposed_speed
-        hysteresis_action = "INCREASE"
-    elif smoothed_speed < current_speed:
-        # Speed decrease - only allow after cooldown period
-        time_since_increase = current_time - last_speed_increase_time
-        if time_since_increase >= SPEED_COOLDOWN:
-            # Cooldown period has passed, allow decrease
+    # Cached log timestamp and the whole second it was formatted for
+    log_ts_sec = -1
+    log_ts_str = ""
+
+    next_poll = monotonic()
+
+    def sig_handler(signum, frame):
+        log_message("Service stopped")
+        if log_fh is not None:
+            log_fh.close()
+        os.remove(IPC_FILE)
+        if os.path.exists(LOG_FILE):
+            os.remove(LOG_FILE)
+        bios_control(True)
+        if ec_mm is not None:
+            ec_mm.close()
+        os.close(ec_fd)
+        sys.exit()
+
+    def ec_read(offset, length):
+        if ec_mm is not None:
+            return ec_mm[offset : offset + length]
+        return os.pread(ec_fd, length, offset)
+
+    def ec_write(offset, data):
+        if ec_mm is not None:
+            ec_mm[offset : offset + len(data)] = data
+        else:
+            os.pwrite(ec_fd, data, offset)
+
+    def update_fan(speed):
+        payload = FAN_TABLE[speed // 5]
+        # Through the mmap a compare is free, so skip writes the EC already
+        # holds. On pread/pwrite a read is an EC transaction like the write it
+        # would save, so just write.
+        if ec_mm is None or ec_mm[FAN1_OFFSET : FAN1_OFFSET + len(payload)] != payload:
+            ec_write(FAN1_OFFSET, payload)
+
+    def log_message(fmt, *args):
+        """Write a timestamped message to the log file
+
+        The message is only formatted (fmt.format(*args)) when logging is on.
+        """
+        nonlocal log_ts_sec, log_ts_str
+        if log_fh is not None:
+            message = fmt.format(*args) if args else fmt
+            # Timestamps have one-second resolution; format each second only once
+            now = int(time())
+            if now != log_ts_sec:
+                log_ts_str = strftime("%Y-%m-%d %H:%M:%S", localtime(now))
+                log_ts_sec = now
+            try:
+                log_fh.write(f"[{log_ts_str}] {message}\n")
+            except Exception:
+                pass  # Fail silently if logging fails
+
+    def get_temp():
+        # The sensors are 96 bytes apart and ec_sys reads byte by byte, so two
+        # single-byte reads are far fewer EC transactions than one spanning read
+        temp_c = ec_read(CPU_TEMP_OFFSET, 1)[0]
+        temp_g = ec_read(GPU_TEMP_OFFSET, 1)[0]
+        return temp_c, temp_g, temp_c if temp_c > temp_g else temp_g
+
+    def wait_for_next_poll():
+        nonlocal next_poll
+        # Polls are scheduled on absolute deadlines so the loop's own work does
+        # not stretch the interval; after a stall the next poll runs at once.
+        now = monotonic()
+        next_poll = max(next_poll + poll_interval, now)
+        if poll_selector.select(timeout=next_poll - now):
+            # Woken by a signal; drain the wakeup bytes before the next wait
+            try:
+                os.read(wake_r, 64)
+            except BlockingIOError:
+                pass
+
+    # Whether the EC has already latched manual mode since we last handed
+    # control back to the BIOS
+    bios_manual = False
+
+    def bios_control(enabled):
+        nonlocal bios_manual
+        if enabled is False:
+            ec_write(BIOS_OFFSET, BIOS_MANUAL)
+            if not bios_manual:
+                # Only the switch out of BIOS control needs time to latch;
+                # later refreshes just rewrite the same mode byte
+                sleep(0.1)
+                bios_manual = True
+            ec_write(TIMER_OFFSET, TIMER_RESET)
+        elif enabled is True:
+            ec_write(BIOS_OFFSET, BIOS_AUTO)
+            ec_write(FAN1_OFFSET, FAN_TABLE[0])
+            bios_manual = False
+
+    signal.signal(signal.SIGTERM, sig_handler)
+
+    with open(IPC_FILE, "w", encoding="utf-8") as ipc:
+        ipc.write(str(os.getpid()))
+
+    # Start outside the deadband of any valid speed so the first poll writes
+    speed_old = -speed_deadband - 1
+    last_speed_increase_time = 0  # Track when we last increased speed
+    current_speed = 0  # Track current applied speed for hysteresis
+    smoothed_speed = None  # Track smoothed speed to reduce oscillation
+    last_log_time = 0  # Track when we last logged
+    # Track when we last disabled BIOS control, on the monotonic clock so a
+    # wall-clock step can't stall the refresh; start due on the first poll
+    last_bios_disable_time = -BIOS_REFRESH_INTERVAL
+    last_temps = None  # Track the previous (CPU, GPU) reading
+
+    log_message("Service started - PID: {}", os.getpid())
+    log_message("Config: TEMP_CURVE={}, SPEED_CURVE={}", temp_curve, speed_curve)
+    log_message(
+        "Settings: COOLDOWN={}s, SMOOTHING={}, DEADBAND={}%",
+        speed_cooldown,
+        speed_smoothing,
+        speed_deadband,
+    )
+
+    while True:
+        cpu_temp, gpu_temp, temp = get_temp()
+        current_time = time()
+
+        # Re-assert manual control periodically rather than on every poll
+        now = monotonic()
+        if now - last_bios_disable_time >= BIOS_REFRESH_INTERVAL:
+            bios_control(False)
+            last_bios_disable_time = now
+
+        # Calculate target speed based on temperature curve
+        target_speed = target_lut[temp]
+
+        # Steady state: same reading as last poll and the speed has settled on the
+        # target, so smoothing, hysteresis and deadband would change nothing
+        if (
+            (cpu_temp, gpu_temp) == last_temps
+            and smoothed_speed == current_speed == target_speed
+            and current_time - last_log_time < log_interval
+        ):
+            wait_for_next_poll()
+            continue
+        last_temps = (cpu_temp, gpu_temp)
+
+        # Apply exponential smoothing to reduce rapid changes
+        if smoothed_speed is None:
+            # First iteration - initialize smoothed speed. Integer smoothing
+            # can settle on exactly 0, so 0 can't mark the first poll.
+            smoothed_speed = target_speed
+        else:
+            # Smooth the target speed to reduce oscillation. The step is rounded
+            # away from zero so the smoothed speed always reaches the target.
+            diff = target_speed - smoothed_speed
+            step = (alpha_num * abs(diff) + ALPHA_DEN - 1) // ALPHA_DEN
+            smoothed_speed += step if diff > 0 else -step
+
+        # Hysteresis logic: Always allow speed increases, but delay decreases
+        hysteresis_action = ""
+        if smoothed_speed > current_speed:
+            # Speed increase - always allow immediately
             proposed_speed = smoothed_speed
+            last_speed_increase_time = current_time
             current_speed = proposed_speed
-            hysteresis_action = "DECREASE"
+            hysteresis_action = "INCREASE"
+        elif smoothed_speed < current_speed:
+            # Speed decrease - only allow after cooldown period
+            time_since_increase = current_time - last_speed_increase_time
+            if time_since_increase >= speed_cooldown:
+                # Cooldown period has passed, allow decrease
+                proposed_speed = smoothed_speed
+                current_speed = proposed_speed
+                hysteresis_action = "DECREASE"
+            else:
+                # Still in cooldown, maintain current speed. The remaining time
+                # is only needed for the log, so only format it when logging.
+                proposed_speed = current_speed
+                hysteresis_action = "COOLDOWN"
+                if log_fh is not None:
+                    hysteresis_action = (
+                        f"COOLDOWN({int(speed_cooldown - time_since_increase)}s)"
+                    )
         else:
-            # Still in cooldown, maintain current speed
-            proposed_speed = current_speed
-            hysteresis_action = (
-                f"COOLDOWN({int(SPEED_COOLDOWN - time_since_increase)}s)"
-            )
-    else:
-        # Speed unchanged
-        proposed_speed = smoothed_speed
-        current_speed = proposed_speed
-        hysteresis_action = "MAINTAIN"
-
-    # Apply deadband filter - only change if difference is significant
-    speed_difference = abs(proposed_speed - speed_old)
-    deadband_applied = False
-    if speed_difference >= SPEED_DEADBAND or speed_old == -1:
-        # Round to nearest 5% to create stable speed steps
-        final_speed = round(proposed_speed / 5) * 5
-
-        # Ensure we stay within bounds
-        final_speed = max(0, min(100, final_speed))
-
-        # Only update fans if speed actually changed
-        if speed_old != final_speed:
-            speed_old = final_speed
-            update_fan(FAN1_MAX * final_speed / 100, FAN2_MAX * final_speed / 100)
+            # Speed unchanged
+            proposed_speed = smoothed_speed
+            current_speed = proposed_speed
+            hysteresis_action = "MAINTAIN"
+
+        # Apply deadband filter - only change if difference is significant
+        speed_difference = abs(proposed_speed - speed_old * 10)
+        deadband_applied = False
+        if speed_difference >= deadband_tenths:
+            # Round to nearest 5% to create stable speed steps
+            final_speed = round(proposed_speed / 50) * 5
+
+            # Ensure we stay within bounds
+            final_speed = max(0, min(100, final_speed))
+
+            # Only update fans if speed actually changed
+            if speed_old != final_speed:
+                speed_old = final_speed
+                update_fan(final_speed)
+                log_message(
+                    "SPEED CHANGE: CPU={}°C GPU={}°C Max={}°C | Target={:.1f}% Smoothed={:.1f}% Final={}% | Action={}",
+                    cpu_temp,
+                    gpu_temp,
+                    temp,
+                    target_speed / 10,
+                    smoothed_speed / 10,
+                    final_speed,
+                    hysteresis_action,
+                )
+        else:
+            deadband_applied = True
+
+        # Log periodic status updates
+        if current_time - last_log_time >= log_interval:
+            status = "DEADBAND" if deadband_applied else hysteresis_action
             log_message(
-                f"SPEED CHANGE: CPU={cpu_temp}°C GPU={gpu_temp}°C Max={temp}°C | Target={target_speed:.1f}% Smoothed={smoothed_speed:.1f}% Final={final_speed}% | Action={hysteresis_action}"
+                "STATUS: CPU={}°C GPU={}°C Max={}°C | Target={:.1f}% Smoothed={:.1f}% Current={}% | {}",
+                cpu_temp,
+                gpu_temp,
+                temp,
+                target_speed / 10,
+                smoothed_speed / 10,
+                speed_old,
+                status,
             )
-    else:
-        deadband_applied = True
-
-    # Log periodic status updates
-    if current_time - last_log_time >= LOG_INTERVAL:
-        status = "DEADBAND" if deadband_applied else hysteresis_action
-        log_message(
-            f"STATUS: CPU={cpu_temp}°C GPU={gpu_temp}°C Max={temp}°C | Target={target_speed:.1f}% Smoothed={smoothed_speed:.1f}% Current={speed_old}% | {status}"
-        )
-        last_log_time = current_time
+            last_log_time = current_time
+
+        wait_for_next_poll()
+
 
-    bios_control(False)
-    sleep(POLL_INTERVAL)
+if __name__ == "__main__":
+    main()